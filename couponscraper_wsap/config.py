@@ -2,7 +2,9 @@
 
 # Scraping settings
 BASE_URL = "https://www.real.discount"
+COUPON_BASE_URL = "https://real.discount"  # host of cached coupon URLs; keep stable for dedup
 RATE_LIMIT_DELAY = 2  # seconds between requests
+COUPON_FETCH_CONCURRENCY = 10  # coupon pages fetched in parallel
 
 # Category mappings with WhatsApp group numbers
 CATEGORIES = {
@@ -85,10 +87,23 @@ SCHEDULE_INTERVAL = 24  # hours
 # Selenium settings
 SELENIUM_TIMEOUT = 10  # seconds
 SCROLL_PAUSE_TIME = 1  # seconds
+BLOCKED_RESOURCE_URLS = [
+    '*.png*', '*.jpg*', '*.jpeg*', '*.gif*', '*.webp*', '*.svg*',
+    '*.woff*', '*.css*',
+    '*/analytics*', '*/ga.js*', '*gtag*'
+]  # URL patterns Chrome never downloads; patterns match the whole URL, so trail with * for query strings
+UDEMY_LINK_WAIT = 3  # max seconds to wait for the Udemy link on a coupon page
+CHROMEDRIVER_MAX_AGE = 7  # days before re-running ChromeDriverManager
 
 # File paths
-CACHE_FILE = "cache/processed_courses.json"
+CACHE_FILE = "cache/processed_courses.jsonl"
+LEGACY_CACHE_FILE = "cache/processed_courses.json"  # imported once if CACHE_FILE is missing
+CHROMEDRIVER_PATH_FILE = "cache/chromedriver_path.txt"
 
 # WhatsApp settings
 WHATSAPP_WAIT_TIME = 30  # seconds to wait for WhatsApp Web to load
 DELAY_BETWEEN_MESSAGES = 20  # seconds between messages to avoid spam detection
+
+# Logging settings
+LOG_LEVEL = "INFO"  # DEBUG also logs every scroll, course and coupon page
+LOG_BUFFER_SIZE = 100  # records buffered before writing to the console
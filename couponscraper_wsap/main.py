@@ -1,15 +1,25 @@
 """Main script for the Real.discount coupon scraper."""
+import asyncio
+import atexit
+import logging
+import logging.handlers
 import os
+import re
+import signal
+import sys
 import time
 from datetime import datetime
 from typing import Dict, List
+from urllib.parse import urljoin
 import json
 import pywhatkit
-import schedule
-from bs4 import BeautifulSoup
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException
 from webdriver_manager.chrome import ChromeDriverManager
 from webdriver_manager.core.os_manager import ChromeType
 from dotenv import load_dotenv
@@ -21,23 +31,72 @@ from utils import (
     save_cache,
     categorize_course,
     format_whatsapp_message,
-    parse_expiry_date
+    parse_expiry_date,
+    fetch_coupon_pages
 )
 
+logger = logging.getLogger(__name__)
+
+# Extract the index-page fields of every course li in one round-trip to the browser
+_EXTRACT_COURSES_JS = r"""
+const byClass = (root, selector, pattern) => Array.from(root.querySelectorAll(selector))
+    .find(el => pattern.test(el.getAttribute('class') || ''));
+const byText = (root, pattern) => {
+    const walker = document.createTreeWalker(root, NodeFilter.SHOW_TEXT);
+    while (walker.nextNode()) {
+        if (pattern.test(walker.currentNode.nodeValue)) return walker.currentNode;
+    }
+    return null;
+};
+const text = node => node ? node.textContent.trim() : null;
+
+const courses = [];
+for (const li of document.querySelectorAll('li')) {
+    const link = li.querySelector('a');
+    const heading = li.querySelector('h3, h4, h5');
+    if (!link || !heading) continue;
+    courses.push({
+        title: text(heading),
+        href: link.getAttribute('href') || '',
+        description: text(
+            li.querySelector('p.description') ||
+            byClass(li, '[class]', /description/i) ||
+            li.querySelector('p') ||
+            byClass(li, 'div[class]', /(desc|about|info)/i)
+        ),
+        price: text(byText(li, /\$|free/i)),
+        expiry: text(
+            li.querySelector('span.expiry-date') ||
+            byClass(li, '[class]', /(expiry|expires|valid)/i) ||
+            byText(li, /(expires|valid until)/i)
+        )
+    });
+}
+return courses;
+"""
+
+_COUPON_RE = re.compile(r'[?&]couponCode=([^&]+)')
+
+# Environment variable holding the WhatsApp group ID of each category
+_CATEGORY_GROUP_ENV = {category: data['group_id'] for category, data in CATEGORIES.items()}
+
 class CouponScraper:
     def __init__(self):
         """Initialize the scraper with necessary configurations."""
         load_dotenv()  # Load WhatsApp group IDs
         self.setup_selenium()
-        self.cache = load_cache()
+        self.seen_urls = load_cache()
+        self._new_urls = []  # Processed URLs not yet written to the cache file
+        self._cache_dirty = False
+        atexit.register(self._flush_cache)
+        signal.signal(signal.SIGTERM, self._handle_sigterm)
         
         # Load WhatsApp group IDs from environment variables
-        self.group_ids = {}
-        for category in CATEGORIES:
-            env_key = CATEGORIES[category]['group_id']
-            group_id = os.getenv(env_key)
-            if group_id:
-                self.group_ids[category] = group_id
+        self.group_ids = {
+            category: os.environ[env_key]
+            for category, env_key in _CATEGORY_GROUP_ENV.items()
+            if os.environ.get(env_key)
+        }
 
     def setup_selenium(self):
         """Set up Selenium WebDriver with Chrome."""
@@ -54,16 +113,14 @@ class CouponScraper:
             chrome_options.add_argument('--proxy-server="direct://"')
             chrome_options.add_argument('--proxy-bypass-list=*')
             chrome_options.add_argument('--ignore-certificate-errors')
+            # Skip image downloads - pages are never rendered visually
+            chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+            chrome_options.add_argument('--disable-images')
+            # Return from driver.get() on DOMContentLoaded instead of the full load
+            chrome_options.page_load_strategy = 'eager'
             
-            # Initialize ChromeDriverManager with specific version and location
-            driver_path = ChromeDriverManager(chrome_type=ChromeType.GOOGLE).install()
-            
-            # Make sure we're using the correct chromedriver executable
-            if not driver_path.endswith('.exe'):
-                driver_dir = os.path.dirname(driver_path)
-                driver_path = os.path.join(driver_dir, 'chromedriver.exe')
-            
-            print(f"ChromeDriver path: {driver_path}")
+            driver_path = self.get_chromedriver_path()
+            logger.info("ChromeDriver path: %s", driver_path)
             
             if not os.path.exists(driver_path):
                 raise FileNotFoundError(f"ChromeDriver not found at {driver_path}")
@@ -77,25 +134,56 @@ class CouponScraper:
                 options=chrome_options
             )
             
+            # Block images, fonts, stylesheets and analytics - only the HTML is used
+            self.driver.execute_cdp_cmd('Network.enable', {})
+            self.driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_RESOURCE_URLS})
+            
             # Set page load timeout
             self.driver.set_page_load_timeout(30)
-            print("Chrome WebDriver setup successful!")
+            logger.info("Chrome WebDriver setup successful!")
             
         except Exception as e:
-            print(f"Failed to setup Chrome WebDriver: {str(e)}")
+            logger.error("Failed to setup Chrome WebDriver: %s", e)
             if hasattr(self, 'driver'):
                 self.driver.quit()
             raise
 
+    def get_chromedriver_path(self) -> str:
+        """Return the ChromeDriver path, only running the installer when the cached path is stale."""
+        driver_path = os.getenv('CHROMEDRIVER_PATH')
+        if driver_path:
+            return driver_path
+        
+        if os.path.exists(CHROMEDRIVER_PATH_FILE):
+            age = time.time() - os.path.getmtime(CHROMEDRIVER_PATH_FILE)
+            if age < CHROMEDRIVER_MAX_AGE * 24 * 3600:
+                with open(CHROMEDRIVER_PATH_FILE, 'r') as f:
+                    driver_path = f.read().strip()
+                if os.path.exists(driver_path):
+                    return driver_path
+        
+        # Initialize ChromeDriverManager with specific version and location
+        driver_path = ChromeDriverManager(chrome_type=ChromeType.GOOGLE).install()
+        
+        # Make sure we're using the correct chromedriver executable
+        if not driver_path.endswith('.exe'):
+            driver_dir = os.path.dirname(driver_path)
+            driver_path = os.path.join(driver_dir, 'chromedriver.exe')
+        
+        os.makedirs(os.path.dirname(CHROMEDRIVER_PATH_FILE), exist_ok=True)
+        with open(CHROMEDRIVER_PATH_FILE, 'w') as f:
+            f.write(driver_path)
+        return driver_path
+
     def scrape_courses(self) -> List[Dict]:
         """Scrape course information from Real.discount."""
         courses = []
         try:
-            print(f"Accessing {BASE_URL}...")
+            logger.info("Accessing %s...", BASE_URL)
             self.driver.get(BASE_URL)
             
             # Scroll to load dynamic content
-            print("Starting page scroll to load dynamic content...")
+            logger.info("Starting page scroll to load dynamic content...")
             last_height = self.driver.execute_script("return document.body.scrollHeight")
             scroll_count = 0
             while True:
@@ -103,135 +191,134 @@ class CouponScraper:
                 time.sleep(SCROLL_PAUSE_TIME)
                 new_height = self.driver.execute_script("return document.body.scrollHeight")
                 scroll_count += 1
-                print(f"Scroll {scroll_count}: Height changed from {last_height} to {new_height}")
+                logger.debug("Scroll %d: Height changed from %s to %s", scroll_count, last_height, new_height)
                 if new_height == last_height or scroll_count >= 5:  # Limit scrolls to 5
                     break
                 last_height = new_height
 
-            print("Parsing page content...")
-            soup = BeautifulSoup(self.driver.page_source, 'html.parser')
-            
-            # Find all course elements - look for li elements containing course information
-            course_elements = soup.find_all('li')
-            print(f"\nFound {len(course_elements)} potential course elements")
+            logger.info("Extracting course elements...")
+            course_elements = self.driver.execute_script(_EXTRACT_COURSES_JS)
+            logger.info("Found %d potential course elements", len(course_elements))
             
+            # Collect the locally available fields first
+            stubs = []
             for element in course_elements:
-                # Check if this li contains a course
-                if element.find('a') and element.find(['h3', 'h4', 'h5']):
-                    course = self.parse_course_element(element)
-                    if course:
-                        if course['url'] not in self.cache:
-                            print(f"New course found: {course['title']}")
-                            courses.append(course)
-                            self.cache[course['url']] = datetime.now().isoformat()
-                        else:
-                            print(f"Course already in cache: {course['url']}")
+                stub = self.parse_course_element(element)
+                if stub:
+                    stubs.append(stub)
+
+            # Uncategorized courses have no group to go to, so skip their coupon pages
+            to_resolve = [stub['coupon_url'] for stub in stubs if stub['category'] != 'other']
+
+            # Resolve the remaining Udemy URLs in a single concurrent batch
+            logger.info("Resolving Udemy URLs for %d of %d courses...", len(to_resolve), len(stubs))
+            udemy_urls = dict(zip(to_resolve, asyncio.run(fetch_coupon_pages(
+                to_resolve,
+                concurrency=COUPON_FETCH_CONCURRENCY
+            ))))
+
+            for stub in stubs:
+                udemy_url = None
+                if stub['category'] != 'other':
+                    udemy_url = udemy_urls[stub['coupon_url']] or self.resolve_udemy_url(stub['coupon_url'])
+                course = self.complete_course(stub, udemy_url)
+                if course['url'] not in self.seen_urls:
+                    logger.debug("New course found: %s", course['title'])
+                    courses.append(course)
+                    self.seen_urls.add(course['url'])
+                    self._new_urls.append(course['url'])
+                    self._cache_dirty = True
+                else:
+                    logger.debug("Course already in cache: %s", course['url'])
 
-            print(f"\nTotal new courses found: {len(courses)}")
-            save_cache(self.cache)
+            logger.info("Total new courses found: %d", len(courses))
             return courses
 
         except Exception as e:
-            print(f"Error scraping courses: {str(e)}")
+            logger.error("Error scraping courses: %s", e)
             return []
 
-    def parse_course_element(self, element) -> Dict:
-        """Parse a course element and extract relevant information."""
+    def parse_course_element(self, element: Dict) -> Dict:
+        """Build a course stub from the fields extracted from an index-page element."""
         try:
-            # Find title - look for headings
-            title_elem = element.find(['h3', 'h4', 'h5'])
-            if not title_elem:
-                return None
-            title = title_elem.text.strip()
-            
-            # Find the main link element
-            link_elem = element.find('a')
-            if not link_elem:
+            title = element['title']
+            if not title:
                 return None
                 
             # Get the coupon URL
-            coupon_url = link_elem.get('href', '').strip()
+            coupon_url = element['href'].strip()
             if not coupon_url:
                 return None
             if not coupon_url.startswith('http'):
-                coupon_url = 'https://real.discount' + coupon_url
-            
-            # Find description for categorization
-            desc_elem = (
-                element.find('p', class_='description') or
-                element.find(class_=lambda x: x and 'description' in str(x).lower()) or
-                element.find('p') or
-                element.find('div', class_=lambda x: x and any(word in str(x).lower() for word in ['desc', 'about', 'info']))
-            )
-            description = desc_elem.text.strip() if desc_elem else title
-
-            # Visit the coupon page to get the Udemy URL
-            try:
-                print(f"Visiting coupon page: {coupon_url}")
-                # Add error handling for DNS resolution
-                try:
-                    self.driver.get(coupon_url)
-                except Exception as e:
-                    if "ERR_NAME_NOT_RESOLVED" in str(e):
-                        print("DNS resolution failed, retrying with alternative URL...")
-                        # Try alternative domain
-                        coupon_url = coupon_url.replace('real.discount', 'www.real.discount')
-                        self.driver.get(coupon_url)
-                    else:
-                        raise e
-                
-                time.sleep(2)  # Wait for page to load
-                
-                # Find the Udemy URL - look for any link to udemy.com
-                soup = BeautifulSoup(self.driver.page_source, 'html.parser')
-                udemy_link = soup.find('a', href=lambda x: x and 'udemy.com' in x)
-                if udemy_link:
-                    udemy_url = udemy_link['href']
-                    print(f"Found Udemy URL: {udemy_url}")
-                else:
-                    print(f"No Udemy URL found for: {title}")
-                    udemy_url = None
-            except Exception as e:
-                print(f"Error getting Udemy URL: {str(e)}")
-                udemy_url = None
+                coupon_url = urljoin(COUPON_BASE_URL, coupon_url)
             
-            # Find price - look for elements containing price information
-            price_elem = element.find(string=lambda x: x and ('$' in x or 'free' in str(x).lower()))
-            original_price = price_elem.strip() if price_elem else 'N/A'
+            # Fall back to the title for categorization
+            description = element['description'] or title
+            original_price = element['price'] or 'N/A'
             
             # Determine course category
-            category = categorize_course(title, description, CATEGORIES)
+            category = categorize_course(title, description)
             
-            # Extract coupon code from Udemy URL if available
-            coupon_code = None
-            if udemy_url:
-                coupon_param = 'couponCode='
-                if coupon_param in udemy_url:
-                    coupon_code = udemy_url.split(coupon_param)[1].split('&')[0]
-            
-            # Find expiry date
-            expiry_elem = (
-                element.find('span', class_='expiry-date') or
-                element.find(class_=lambda x: x and any(word in str(x).lower() for word in ['expiry', 'expires', 'valid'])) or
-                element.find(string=lambda x: x and any(word in str(x).lower() for word in ['expires', 'valid until']))
-            )
-            expiry_date = parse_expiry_date(expiry_elem.text.strip()) if expiry_elem else None
+            # Parse expiry date
+            expiry_date = parse_expiry_date(element['expiry']) if element['expiry'] else None
             
             return {
                 'title': title,
                 'description': description,
-                'url': udemy_url or coupon_url,  # Use udemy_url if available, otherwise coupon_url
-                'udemy_url': udemy_url,
+                'coupon_url': coupon_url,
                 'original_price': original_price,
-                'coupon_code': coupon_code,
                 'expiry_date': expiry_date,
-                'category': category  # Add category to the returned dictionary
+                'category': category
             }
             
         except Exception as e:
-            print(f"Error parsing course element: {str(e)}")
+            logger.error("Error parsing course element: %s", e)
             return None
 
+    def resolve_udemy_url(self, coupon_url: str) -> str:
+        """Fall back to Selenium for coupon pages that render their Udemy link with JS."""
+        try:
+            logger.debug("Visiting coupon page: %s", coupon_url)
+            # Add error handling for DNS resolution
+            try:
+                self.driver.get(coupon_url)
+            except Exception as e:
+                if "ERR_NAME_NOT_RESOLVED" in str(e):
+                    logger.warning("DNS resolution failed, retrying with alternative URL...")
+                    # Try alternative domain
+                    coupon_url = coupon_url.replace('://real.discount', '://www.real.discount')
+                    self.driver.get(coupon_url)
+                else:
+                    raise e
+            
+            # Wait only until a link to udemy.com shows up
+            try:
+                udemy_link = WebDriverWait(self.driver, UDEMY_LINK_WAIT).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, 'a[href*="udemy.com"]'))
+                )
+            except TimeoutException:
+                logger.debug("No Udemy URL found for: %s", coupon_url)
+                return None
+            udemy_url = udemy_link.get_attribute('href')
+            logger.debug("Found Udemy URL: %s", udemy_url)
+            return udemy_url
+        except Exception as e:
+            logger.error("Error getting Udemy URL: %s", e)
+        return None
+
+    def complete_course(self, stub: Dict, udemy_url: str) -> Dict:
+        """Merge a resolved Udemy URL into a course stub."""
+        # Extract coupon code from Udemy URL if available
+        match = _COUPON_RE.search(udemy_url) if udemy_url else None
+        coupon_code = match.group(1) if match else None
+        
+        return {
+            **stub,
+            'url': udemy_url or stub['coupon_url'],  # Use udemy_url if available, otherwise coupon_url
+            'udemy_url': udemy_url,
+            'coupon_code': coupon_code
+        }
+
     def send_whatsapp_message(self, message: str, group_id: str):
         """Send a WhatsApp message using pywhatkit."""
         try:
@@ -244,46 +331,71 @@ class CouponScraper:
             )
             time.sleep(DELAY_BETWEEN_MESSAGES)
         except Exception as e:
-            print(f"Error sending WhatsApp message: {str(e)}")
+            logger.error("Error sending WhatsApp message: %s", e)
 
     def process_and_send_courses(self):
         """Main function to scrape courses and send WhatsApp messages."""
-        courses = self.scrape_courses()
-        if not courses:
-            return
+        try:
+            courses = self.scrape_courses()
+            if not courses:
+                return
 
-        # Group courses by category
-        categorized_courses = {}
-        for course in courses:
-            category = course['category']
-            if category not in categorized_courses:
-                categorized_courses[category] = []
-            categorized_courses[category].append(course)
+            # Group courses by category
+            categorized_courses = {}
+            for course in courses:
+                category = course['category']
+                if category not in categorized_courses:
+                    categorized_courses[category] = []
+                categorized_courses[category].append(course)
 
-        # Send a message for each category to its corresponding WhatsApp group
-        for category, category_courses in categorized_courses.items():
-            if category in self.group_ids:
-                message = format_whatsapp_message(
-                    category_courses,
-                    category,
-                    MESSAGE_TEMPLATE
-                )
-                self.send_whatsapp_message(message, self.group_ids[category])
-                time.sleep(DELAY_BETWEEN_MESSAGES)
+            # Send a message for each category to its corresponding WhatsApp group
+            for category, category_courses in categorized_courses.items():
+                if category in self.group_ids:
+                    message = format_whatsapp_message(category_courses, category)
+                    self.send_whatsapp_message(message, self.group_ids[category])
+        finally:
+            # Persist this cycle's new URLs once, then write out its buffered log records
+            self._flush_cache()
+            for handler in logging.getLogger().handlers:
+                handler.flush()
 
     def run_scheduled(self):
         """Run the scraper on a schedule."""
-        schedule.every(SCHEDULE_INTERVAL).hours.do(self.process_and_send_courses)
+        interval = SCHEDULE_INTERVAL * 3600
+        next_run = time.monotonic() + interval
         
+        # Sleep straight through to the next run instead of polling
         while True:
-            schedule.run_pending()
-            time.sleep(1)
+            time.sleep(max(0, next_run - time.monotonic()))
+            self.process_and_send_courses()
+            next_run += interval
+
+    def _flush_cache(self):
+        """Write newly processed URLs to the cache file if there are any."""
+        if self._cache_dirty:
+            save_cache(self._new_urls)
+            self._new_urls = []
+            self._cache_dirty = False
+
+    def _handle_sigterm(self, signum, frame):
+        """Persist the cache before exiting on SIGTERM."""
+        self._flush_cache()
+        sys.exit(0)
 
     def cleanup(self):
         """Clean up resources."""
+        self._flush_cache()
         self.driver.quit()
 
 if __name__ == "__main__":
+    # Buffer records and write them out in batches; errors are written immediately
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    logging.basicConfig(
+        level=LOG_LEVEL,
+        handlers=[logging.handlers.MemoryHandler(capacity=LOG_BUFFER_SIZE, target=stream_handler)]
+    )
+    
     scraper = CouponScraper()
     try:
         # Run once immediately
@@ -291,6 +403,6 @@ if __name__ == "__main__":
         # Then start the schedule
         scraper.run_scheduled()
     except KeyboardInterrupt:
-        print("\nStopping scraper...")
+        logger.info("Stopping scraper...")
     finally:
         scraper.cleanup()
@@ -1,63 +1,181 @@
 """Utility functions for the coupon scraper."""
+import asyncio
+import functools
 import json
+import logging
 import os
+import random
+import string
 from datetime import datetime
-from fake_useragent import UserAgent
-from typing import Dict, List, Optional
+import aiohttp
+from lxml import html as lxml_html
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    import ahocorasick
+except ImportError:  # Fall back to a linear keyword scan
+    ahocorasick = None
+
+from config import CACHE_FILE, CATEGORIES, LEGACY_CACHE_FILE, COURSE_TEMPLATE, MESSAGE_TEMPLATE, RATE_LIMIT_DELAY
+
+logger = logging.getLogger(__name__)
+
+_UA_POOL: Tuple[str, ...] = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 Edg/120.0.0.0',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36 Edg/119.0.0.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Safari/605.1.15',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:120.0) Gecko/20100101 Firefox/120.0',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:119.0) Gecko/20100101 Firefox/119.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:121.0) Gecko/20100101 Firefox/121.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:120.0) Gecko/20100101 Firefox/120.0',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:121.0) Gecko/20100101 Firefox/121.0',
+    'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 OPR/106.0.0.0',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36',
+)
+
+# Keywords lowercased once; earlier categories keep shared keywords
+_KEYWORD_CATEGORIES: Dict[str, str] = {}
+for _category, _data in CATEGORIES.items():
+    for _keyword in _data['keywords']:
+        _KEYWORD_CATEGORIES.setdefault(_keyword.lower(), _category)
+
+# Build the keyword automaton once so categorization is a single pass per course
+_AC = None
+if ahocorasick is not None:
+    _AC = ahocorasick.Automaton()
+    for _keyword, _category in _KEYWORD_CATEGORIES.items():
+        _AC.add_word(_keyword, (_keyword, _category))
+    _AC.make_automaton()
+
+class _TemplateFormatter(string.Formatter):
+    """Formatter that renders missing template fields as 'N/A'."""
+
+    def get_value(self, key, args, kwargs):
+        return kwargs.get(key, 'N/A')
+
+_FORMATTER = _TemplateFormatter()
+
+def _parse_template(template: str) -> List[Tuple[str, Optional[str], str, Optional[str]]]:
+    """Split a template into (literal, field, format_spec, conversion) parts."""
+    parts = list(_FORMATTER.parse(template))
+    for _, field, format_spec, _ in parts:
+        if field is not None and '{' in format_spec:
+            raise ValueError(f"Nested format specs are not supported in templates: {{{field}:{format_spec}}}")
+    return parts
+
+# Pre-parse the message templates so rendering is plain string joining
+_COURSE_PARTS = _parse_template(COURSE_TEMPLATE)
+_MESSAGE_PARTS = _parse_template(MESSAGE_TEMPLATE)
 
 def get_random_user_agent() -> str:
     """Generate a random user agent string."""
-    ua = UserAgent()
-    return ua.random
-
-def load_cache() -> Dict:
-    """Load the cache of processed courses."""
-    if os.path.exists('cache/processed_courses.json'):
-        with open('cache/processed_courses.json', 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_cache(cache: Dict) -> None:
-    """Save the cache of processed courses."""
-    os.makedirs('cache', exist_ok=True)
-    with open('cache/processed_courses.json', 'w') as f:
-        json.dump(cache, f)
-
-def categorize_course(title: str, description: str, categories: Dict) -> str:
+    return random.choice(_UA_POOL)
+
+def _iter_cache_urls(path: str) -> Iterable[str]:
+    """Yield the URLs recorded in the append-only cache file."""
+    with open(path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)['url']
+            except (json.JSONDecodeError, KeyError, TypeError):
+                # A crash during save_cache can leave a torn line behind
+                logger.warning("Skipping corrupt line %d in %s", line_number, path)
+
+def _import_legacy_cache() -> None:
+    """Convert the old processed_courses.json dict into the JSONL cache once."""
+    with open(LEGACY_CACHE_FILE, 'r') as f:
+        legacy = json.load(f)
+    with open(CACHE_FILE, 'w') as f:
+        for url, processed_at in legacy.items():
+            f.write(json.dumps({'url': url, 'processed_at': processed_at}) + '\n')
+    logger.info("Imported %d URLs from %s", len(legacy), LEGACY_CACHE_FILE)
+
+def load_cache() -> Set[str]:
+    """Load the set of already processed course URLs."""
+    if not os.path.exists(CACHE_FILE) and os.path.exists(LEGACY_CACHE_FILE):
+        _import_legacy_cache()
+    if os.path.exists(CACHE_FILE):
+        return set(_iter_cache_urls(CACHE_FILE))
+    return set()
+
+def save_cache(new_urls: Iterable[str]) -> None:
+    """Append newly processed course URLs to the cache."""
+    os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+    processed_at = datetime.now().isoformat()
+    # Start on a fresh line if the last write was cut off mid-line
+    torn = False
+    if os.path.exists(CACHE_FILE) and os.path.getsize(CACHE_FILE) > 0:
+        with open(CACHE_FILE, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b'\n'
+    with open(CACHE_FILE, 'a') as f:
+        if torn:
+            f.write('\n')
+        for url in new_urls:
+            f.write(json.dumps({'url': url, 'processed_at': processed_at}) + '\n')
+
+@functools.lru_cache(maxsize=1024)
+def _categorize_text(title_desc: str) -> str:
+    """Return the category of the first keyword found in lowercased text."""
+    if _AC is not None:
+        for _, (keyword, category) in _AC.iter(title_desc):
+            return category
+        return 'other'
+    
+    # Same result as the automaton: earliest-ending keyword, longest first on ties
+    matches = [
+        (start + len(keyword), -len(keyword), category)
+        for keyword, category in _KEYWORD_CATEGORIES.items()
+        for start in (title_desc.find(keyword),)
+        if start != -1
+    ]
+    return min(matches)[2] if matches else 'other'
+
+def categorize_course(title: str, description: str) -> str:
     """Categorize a course based on its title and description."""
     title_desc = (title + ' ' + description).lower()
     
-    # Check each category's keywords
-    for category, data in categories.items():
-        if any(keyword in title_desc for keyword in data['keywords']):
-            return category
-            
-    # If no match is found, try to find partial matches
-    for category, data in categories.items():
-        if any(any(word in keyword for word in title_desc.split()) 
-               for keyword in data['keywords']):
-            return category
-            
-    return 'other'
+    # Courses without a description have unique text, so don't fill the cache with them
+    if description == title:
+        return _categorize_text.__wrapped__(title_desc)
+    return _categorize_text(title_desc)
+
+def _render(parts: List[Tuple[str, Optional[str], str, Optional[str]]], fields: Dict) -> str:
+    """Render pre-parsed template parts, using 'N/A' for missing fields."""
+    rendered = []
+    for literal, field, format_spec, conversion in parts:
+        rendered.append(literal)
+        if field is None:
+            continue
+        if not format_spec and not conversion and field.isidentifier():
+            rendered.append(str(fields.get(field, 'N/A')))
+            continue
+        value, _ = _FORMATTER.get_field(field, (), fields)
+        rendered.append(_FORMATTER.format_field(_FORMATTER.convert_field(value, conversion), format_spec))
+    return ''.join(rendered)
 
-def format_whatsapp_message(courses: List[Dict], category: str, template: str) -> str:
+def format_whatsapp_message(courses: List[Dict], category: str) -> str:
     """Format courses into a WhatsApp message."""
-    formatted_courses = []
-    for course in courses:
-        course_text = template.format(
-            title=course['title'],
-            original_price=course.get('original_price', 'N/A'),
-            coupon_code=course.get('coupon_code', 'N/A'),
-            expiry_date=course.get('expiry_date', 'N/A'),
-            url=course['url']
-        )
-        formatted_courses.append(course_text)
+    formatted_courses = [_render(_COURSE_PARTS, course) for course in courses[:10]]  # Limit to 10 courses per message
     
-    return template.format(
-        category=category.replace('_', ' ').title(),
-        courses='\n'.join(formatted_courses[:10])  # Limit to 10 courses per message
-    )
+    return _render(_MESSAGE_PARTS, {
+        'category': category.replace('_', ' ').title(),
+        'courses': '\n'.join(formatted_courses)
+    })
 
+@functools.lru_cache(maxsize=512)
 def parse_expiry_date(date_str: Optional[str]) -> Optional[str]:
     """Parse and format expiry date string."""
     if not date_str:
@@ -67,3 +185,50 @@ def parse_expiry_date(date_str: Optional[str]) -> Optional[str]:
         return date_obj.strftime('%B %d, %Y')
     except ValueError:
         return date_str
+
+async def _get_page(session: aiohttp.ClientSession, url: str) -> Optional[bytes]:
+    """Return the raw body of a page, or None for non-2xx responses."""
+    async with session.get(url) as response:
+        if not 200 <= response.status < 300:
+            logger.warning("Skipping coupon page %s: HTTP %d", url, response.status)
+            return None
+        # Raw bytes let lxml honour the page's own encoding declaration
+        return await response.read()
+
+async def _fetch_udemy_url(session: aiohttp.ClientSession, url: str,
+                           semaphore: asyncio.Semaphore, delay: float) -> Optional[str]:
+    """Fetch a single coupon page and return the Udemy URL it links to."""
+    async with semaphore:
+        try:
+            try:
+                html = await _get_page(session, url)
+            except aiohttp.ClientConnectorError:
+                # Retry DNS/connection failures with the www domain
+                html = await _get_page(session, url.replace('://real.discount', '://www.real.discount'))
+        except Exception as e:  # One bad page must not abort the whole batch
+            logger.error("Error fetching coupon page %s: %s", url, e)
+            return None
+        finally:
+            await asyncio.sleep(delay)  # Hold the slot to respect the rate limit
+
+    if not html:
+        return None
+
+    # Query the lxml tree directly; only one attribute is needed from the page
+    try:
+        hrefs = lxml_html.fromstring(html).xpath('//a[contains(@href, "udemy.com")]/@href')
+    except Exception as e:  # Empty or malformed document
+        logger.error("Error parsing coupon page %s: %s", url, e)
+        return None
+    return hrefs[0] if hrefs else None
+
+async def fetch_coupon_pages(urls: List[str], concurrency: int = 10,
+                             delay: float = RATE_LIMIT_DELAY) -> List[Optional[str]]:
+    """Fetch coupon pages concurrently and return their Udemy URLs in input order."""
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {'User-Agent': get_random_user_agent()}
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(headers=headers, timeout=timeout) as session:
+        return await asyncio.gather(
+            *(_fetch_udemy_url(session, url, semaphore, delay) for url in urls)
+        )